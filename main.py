@@ -11,9 +11,18 @@ import argparse
 import csv
 import base64
 import fnmatch
-from typing import Optional, List, Dict, Tuple, Iterable
+import hashlib
+import io
+import itertools
+from typing import Optional, List, Dict, Tuple, Iterable, TextIO, Callable, TypeVar
 
 APP_WIDTH, APP_HEIGHT = 720, 480
+T = TypeVar('T')
+CSV_FIELDS = ['path', 'type', 'data_b64', 'mode', 'mtime']
+CHUNK_SIZE = 3 * 16 * 1024  # кратно 3, чтобы base64 кусков склеивался без паддинга
+MODE_NONE = 'none'  # явный сброс mode в дельте (пустое поле — «не менять»)
+# base64 крупных файлов не влезает в стандартный лимит поля csv (128 KiB)
+csv.field_size_limit(2**31 - 1)
 
 # ========== Транслитерация RU->QWERTY ==========
 RU_TO_QWERTY = {
@@ -50,14 +59,25 @@ def perms_to_string(mode: Optional[int], is_dir: bool) -> str:
 # ========== Абстракция ФС ==========
 class IFs:
     def abspath(self, cwd: str, path: str) -> str: ...
+    def join(self, dirpath: str, name: str) -> str:
+        """
+        Буквальное соединение каталога и имени (без раскрытия ~ и нормализации).
+        """
+        ...
     def is_dir(self, path: str) -> bool: ...
     def list_dir(self, path: str) -> List[str]: ...
     def lstat(self, path: str) -> Tuple[bool, Optional[int], int, float, str]: ...
     def exists(self, path: str) -> bool: ...
     def read_file(self, path: str) -> bytes: ...
-    def walk(self, start: str) -> Iterable[Tuple[str, List[str], List[str]]]:
+    def iter_file(self, path: str, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+        """
+        Чтение файла кусками не больше chunk_size байт (для потоковой обработки).
+        """
+        ...
+    def walk(self, start: str, onerror: Optional[Callable[[OSError], None]] = None) -> Iterable[Tuple[str, List[str], List[str]]]:
         """
         Аналог os.walk: yield (dirpath, dirnames, filenames), где dirpath — абсолютный путь в терминах этой ФС.
+        onerror, как в os.walk, вызывается для каталогов, которые не удалось прочитать.
         """
         ...
 
@@ -71,6 +91,9 @@ class OsFs(IFs):
             return os.path.abspath(path)
         return os.path.abspath(os.path.join(cwd, path))
 
+    def join(self, dirpath: str, name: str) -> str:
+        return os.path.join(dirpath, name)
+
     def is_dir(self, path: str) -> bool:
         try:
             st = os.stat(path)
@@ -93,8 +116,16 @@ class OsFs(IFs):
         with open(path, 'rb') as f:
             return f.read()
 
-    def walk(self, start: str) -> Iterable[Tuple[str, List[str], List[str]]]:
-        for dirpath, dirnames, filenames in os.walk(start):
+    def iter_file(self, path: str, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def walk(self, start: str, onerror: Optional[Callable[[OSError], None]] = None) -> Iterable[Tuple[str, List[str], List[str]]]:
+        for dirpath, dirnames, filenames in os.walk(start, onerror=onerror):
             dirnames.sort()
             filenames.sort()
             yield dirpath, dirnames, filenames
@@ -113,6 +144,8 @@ class MemoryVfs(IFs):
     """
     CSV-формат с заголовками: path,type,data_b64,mode,mtime
     type: dir|file, data_b64 — base64 для файлов (может быть пусто).
+    Для дельт (vfs-diff) дополнительно:
+    type: del — удалить path (вместе с поддеревом), meta — обновить только mode/mtime.
     """
     def __init__(self):
         self.root = VfsNode('/', True)
@@ -159,43 +192,63 @@ class MemoryVfs(IFs):
                 return None
         return node
 
+    @staticmethod
+    def _apply_attrs(node: VfsNode, mode_raw: str, mtime: Optional[float]) -> None:
+        node.mtime = mtime if mtime is not None else node.mtime
+        if mode_raw:
+            try: node.mode = int(mode_raw, 0)
+            except ValueError: node.mode = None  # в т.ч. MODE_NONE
+
     def load_from_csv(self, csv_path: str) -> None:
-        with open(csv_path, 'r', encoding='utf-8') as f:
+        """
+        Загрузка CSV поверх текущего содержимого: полный образ или дельта из vfs-diff.
+        Сначала разбирается весь файл; при ошибке (csv, base64, mtime) VFS не меняется.
+        """
+        rows: List[Tuple[str, str, bytes, str, Optional[float]]] = []
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
             reader = csv.DictReader(f)
             for row in reader:
-                p = (row.get('path') or '').strip()
-                t = (row.get('type') or '').strip().lower()
-                data_b64 = (row.get('data_b64') or '').strip()
-                mode_raw = (row.get('mode') or '').strip()
-                mtime_raw = (row.get('mtime') or '').strip()
+                # path не обрезается: пробелы в начале/конце имени допустимы
+                p = row.get('path') or ''
+                t, data_b64, mode_raw, mtime_raw = ((row.get(k) or '').strip() for k in CSV_FIELDS[1:])
+                t = t.lower()
                 if not p or not t:
                     continue
+                content = base64.b64decode(data_b64) if t == 'file' and data_b64 else b''
+                mtime = float(mtime_raw) if mtime_raw else None
+                rows.append((t, self._norm(p), content, mode_raw, mtime))
 
-                norm = self._norm(p)
-                parent = os.path.dirname(norm)
-                name = os.path.basename(norm)
+        for t, norm, content, mode_raw, mtime in rows:
+            parent = os.path.dirname(norm)
+            name = os.path.basename(norm)
 
-                if t == 'dir':
-                    d = self._ensure_dir(norm)
-                    d.mtime = float(mtime_raw) if mtime_raw else d.mtime
-                    if mode_raw:
-                        try: d.mode = int(mode_raw, 0)
-                        except ValueError: d.mode = None
-                    continue
+            if t == 'dir':
+                self._apply_attrs(self._ensure_dir(norm), mode_raw, mtime)
+                continue
 
-                if t == 'file':
-                    dparent = self._ensure_dir(parent)
-                    node = dparent.children.get(name)
-                    if node is None:
-                        node = VfsNode(name, False)
-                        dparent.children[name] = node
-                    node.is_dir = False
-                    node.content = base64.b64decode(data_b64) if data_b64 else b''
-                    node.mtime = float(mtime_raw) if mtime_raw else node.mtime
-                    if mode_raw:
-                        try: node.mode = int(mode_raw, 0)
-                        except ValueError: node.mode = None
-                    continue
+            if t == 'del':
+                dparent = self._get_node(parent)
+                if dparent is not None and dparent.is_dir:
+                    dparent.children.pop(name, None)
+                continue
+
+            if t == 'meta':
+                node = self._get_node(norm)
+                if node is not None:
+                    self._apply_attrs(node, mode_raw, mtime)
+                continue
+
+            if t == 'file':
+                dparent = self._ensure_dir(parent)
+                node = dparent.children.get(name)
+                if node is None:
+                    node = VfsNode(name, False)
+                    dparent.children[name] = node
+                node.is_dir = False
+                node.children = {}
+                node.content = content
+                self._apply_attrs(node, mode_raw, mtime)
+                continue
 
     # ---- IFs ----
     def abspath(self, cwd: str, path: str) -> str:
@@ -210,6 +263,9 @@ class MemoryVfs(IFs):
             base = '/' + base
         return self._norm(os.path.join(base, path))
 
+    def join(self, dirpath: str, name: str) -> str:
+        return dirpath.rstrip('/') + '/' + name
+
     def is_dir(self, path: str) -> bool:
         node = self._get_node(path)
         return bool(node and node.is_dir)
@@ -238,8 +294,13 @@ class MemoryVfs(IFs):
             raise IsADirectoryError(path)
         return node.content
 
-    def walk(self, start: str) -> Iterable[Tuple[str, List[str], List[str]]]:
-        # DFS обход
+    def iter_file(self, path: str, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+        data = memoryview(self.read_file(path))
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    def walk(self, start: str, onerror: Optional[Callable[[OSError], None]] = None) -> Iterable[Tuple[str, List[str], List[str]]]:
+        # DFS обход (в памяти ошибок чтения нет, onerror не используется)
         start_node = self._get_node(start)
         if start_node is None or not start_node.is_dir:
             return
@@ -259,6 +320,216 @@ class MemoryVfs(IFs):
             for dn in reversed(dirnames):
                 stack.append(fulljoin(dpath, dn))
 
+# ========== Экспорт / дельты образов ==========
+ImageEntry = Tuple[str, bool, Optional[int], int, float]  # full, is_dir, mode, size, mtime
+
+def _warn(warnings: Optional[List[str]], msg: str) -> None:
+    if warnings is not None:
+        warnings.append(msg)
+
+def iter_image(fs: IFs, start: str, skip: Iterable[str] = (),
+               warnings: Optional[List[str]] = None,
+               unreadable: Optional[List[str]] = None) -> Iterable[Tuple[str, ImageEntry]]:
+    """
+    Обход поддерева start: yield (rel, entry), где rel — путь в образе ('/a/b').
+    Сам start не выдаётся; симлинки, устройства и т.п. пропускаются молча,
+    имена не в UTF-8 и недоступные записи — с сообщением в warnings.
+    rel недоступных записей и непрочитанных каталогов (их содержимое неизвестно)
+    добавляются в unreadable ('' — сам start).
+    """
+    skip = set(skip)
+    rels = {start: ''}
+
+    def onerror(e: OSError) -> None:
+        rel = rels.pop(e.filename, None)
+        if rel is None:
+            return
+        _warn(warnings, f"cannot list {e.filename}: {e.strerror or e}")
+        if unreadable is not None:
+            unreadable.append(rel)
+
+    for dirpath, dirnames, filenames in fs.walk(start, onerror):
+        base = rels.pop(dirpath, None)
+        if base is None:
+            continue
+        for name in dirnames + filenames:
+            full = fs.join(dirpath, name)
+            if full in skip:
+                continue
+            try:
+                name.encode('utf-8')
+            except UnicodeEncodeError:
+                _warn(warnings, f"skipped non-UTF-8 name: {full!r}")
+                continue
+            try:
+                isdir, mode, size, mtime, _ = fs.lstat(full)
+            except OSError as e:
+                _warn(warnings, f"skipped {full}: {e}")
+                if unreadable is not None:
+                    unreadable.append(base + '/' + name)
+                continue
+            if mode is not None and stat.S_IFMT(mode) and not (stat.S_ISDIR(mode) or stat.S_ISREG(mode)):
+                continue
+            rel = base + '/' + name
+            if isdir:
+                rels[full] = rel
+            yield rel, (full, isdir, mode, size, mtime)
+
+def _csv_cell(value: str) -> str:
+    buf = io.StringIO()
+    # lineterminator не пустой: иначе csv не берёт в кавычки поле с '\n'
+    csv.writer(buf, lineterminator='\n').writerow([value])
+    return buf.getvalue()[:-1]
+
+def _write_b64(out: TextIO, chunks: Iterable[bytes]) -> None:
+    # base64 пишется по кускам: остаток (<3 байт) переносится в следующий кусок
+    rest = b''
+    for chunk in chunks:
+        buf = rest + bytes(chunk)
+        cut = len(buf) - len(buf) % 3
+        out.write(base64.b64encode(buf[:cut]).decode('ascii'))
+        rest = buf[cut:]
+    if rest:
+        out.write(base64.b64encode(rest).decode('ascii'))
+
+def _write_row(out: TextIO, fs: IFs, rel: str, kind: str, entry: Optional[ImageEntry],
+               warnings: Optional[List[str]] = None, none_mode: str = '') -> bool:
+    """
+    Одна строка CSV. Для файлов первый кусок читается до записи префикса строки:
+    нечитаемый файл пропускается (False + сообщение), а не обрывает строку.
+    """
+    if entry is None:
+        out.write(_csv_cell(rel) + ',' + kind + ',,,\n')
+        return True
+    full, _, mode, _, mtime = entry
+    chunks: Iterable[bytes] = ()
+    if kind == 'file':
+        try:
+            chunks = iter(fs.iter_file(full))
+            first = next(chunks, b'')
+        except OSError as e:
+            _warn(warnings, f"skipped {full}: {e}")
+            return False
+        chunks = itertools.chain([first], chunks)
+    out.write(_csv_cell(rel) + ',' + kind + ',')
+    _write_b64(out, chunks)
+    out.write(',' + (oct(mode) if mode is not None else none_mode) + ',' + repr(mtime) + '\n')
+    return True
+
+def _write_header(out: TextIO) -> None:
+    out.write(','.join(CSV_FIELDS) + '\n')
+
+def _same_content(old_fs: IFs, old_path: str, new_fs: IFs, new_path: str) -> bool:
+    def digest(fs: IFs, path: str) -> bytes:
+        h = hashlib.sha256()
+        for chunk in fs.iter_file(path):
+            h.update(chunk)
+        return h.digest()
+    try:
+        return digest(old_fs, old_path) == digest(new_fs, new_path)
+    except OSError:
+        return False
+
+def export_csv(fs: IFs, start: str, out: TextIO, skip: Iterable[str] = (),
+               warnings: Optional[List[str]] = None) -> int:
+    """
+    Потоковая выгрузка поддерева start в CSV-формат MemoryVfs.load_from_csv.
+    Возвращает число записанных строк.
+    """
+    _write_header(out)
+    count = 0
+    for rel, entry in iter_image(fs, start, skip, warnings):
+        if _write_row(out, fs, rel, 'dir' if entry[1] else 'file', entry, warnings):
+            count += 1
+    return count
+
+def diff_csv(old_fs: IFs, old_start: str, new_fs: IFs, new_start: str, out: TextIO,
+             skip: Iterable[str] = (), warnings: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Дельта old -> new в CSV для наложения поверх уже загруженной VFS (vfs-load).
+    Файлы сравниваются по размеру и mtime; содержимое хешируется только
+    при совпадении размера и различии mtime. Возвращает счётчики по типам строк.
+    Под непрочитанными в new каталогами строки del не пишутся: их состояние неизвестно.
+    """
+    unknown: List[str] = []
+    old = dict(iter_image(old_fs, old_start, skip, warnings))
+    new = dict(iter_image(new_fs, new_start, skip, warnings, unknown))
+    stats = {'dir': 0, 'file': 0, 'meta': 0, 'del': 0}
+
+    def is_unknown(rel: str) -> bool:
+        return any(rel == u or rel.startswith(u + '/') for u in unknown)
+
+    removed = {p for p, e in old.items()
+               if (p not in new and not is_unknown(p)) or (p in new and new[p][1] != e[1])}
+
+    _write_header(out)
+    for rel in sorted(removed):
+        parent = os.path.dirname(rel)
+        while parent != '/' and parent not in removed:
+            parent = os.path.dirname(parent)
+        if parent in removed:
+            continue
+        _write_row(out, new_fs, rel, 'del', None)
+        stats['del'] += 1
+
+    for rel, entry in new.items():
+        _, isdir, mode, size, mtime = entry
+        kind = 'dir' if isdir else 'file'
+        prev = old.get(rel)
+        if prev is not None and rel not in removed:
+            _, _, pmode, psize, pmtime = prev
+            if isdir:
+                if (pmode, pmtime) == (mode, mtime):
+                    continue
+            elif size == psize:
+                if pmtime == mtime:
+                    if pmode == mode:
+                        continue
+                    kind = 'meta'
+                elif _same_content(old_fs, prev[0], new_fs, entry[0]):
+                    kind = 'meta'
+        if _write_row(out, new_fs, rel, kind, entry, warnings, none_mode=MODE_NONE):
+            stats[kind] += 1
+    return stats
+
+def write_csv_atomic(path: str, produce: Callable[[TextIO], T]) -> T:
+    """
+    Запись через path.tmp + os.replace: при ошибке на диске не остаётся обрезанный CSV.
+    """
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            result = produce(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return result
+
+def diff_images(old_path: str, new_path: str, out_path: str,
+                warnings: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    vfs-diff по абсолютным путям реальной ФС. Сам OUT и CSV-образы OLD/NEW
+    не попадают в дельту, даже если лежат внутри сравниваемого каталога.
+    """
+    skip = [out_path, out_path + '.tmp'] + [p for p in (old_path, new_path) if os.path.isfile(p)]
+    old_fs, old_start = open_image(old_path)
+    new_fs, new_start = open_image(new_path)
+    return write_csv_atomic(
+        out_path, lambda f: diff_csv(old_fs, old_start, new_fs, new_start, f, skip, warnings))
+
+def open_image(path: str) -> Tuple[IFs, str]:
+    """
+    Образ для vfs-diff по абсолютному пути реальной ФС:
+    каталог (OsFs) или CSV-файл (грузится в MemoryVfs).
+    """
+    if os.path.isdir(path):
+        return OsFs(), path
+    vfs = MemoryVfs()
+    vfs.load_from_csv(path)
+    return vfs, '/'
+
 # ========== Укор. отображение пути в prompt ==========
 def shorten_home_os(path: str) -> str:
     home = os.path.expanduser("~")
@@ -313,7 +584,10 @@ class ShellEmulatorGUI:
         self.println(f"User: {self.username}  Host: {self.hostname}")
         self.println(args_debug)
         self.println(f"Mode: {'VFS(in-memory from CSV)' if self.vfs_mode else 'OS filesystem'}")
-        self.println("Commands: ls [-a] [-l] [path...], cd [path], pwd, cat FILE..., find [PATH...] [-name PATTERN] [-type f|d] [-maxdepth N], exit")
+        self.println("Commands: ls [-a] [-l] [path...], cd [path], pwd, cat FILE..., find [PATH...] [-name PATTERN] [-type f|d] [-maxdepth N], vfs-export [PATH] OUT, vfs-diff OLD NEW OUT, vfs-load CSV, exit")
+        self.println("Incremental update: vfs-diff old.csv NEW_DIR delta.csv, then vfs-load delta.csv in VFS mode.")
+        if self.vfs_mode:
+            self.println("Host paths (OUT/OLD/NEW/CSV) are relative to the launch directory.")
         self.println("Ctrl+L — переключение «латиницы».")
         self.print_prompt()
         self.entry.focus_set()
@@ -397,6 +671,9 @@ class ShellEmulatorGUI:
         if cmd == "ls":   self.cmd_ls(args);  return
         if cmd == "cat":  self.cmd_cat(args); return
         if cmd == "find": self.cmd_find(args);return
+        if cmd == "vfs-export": self.cmd_vfs_export(args); return
+        if cmd == "vfs-diff":   self.cmd_vfs_diff(args);   return
+        if cmd == "vfs-load":   self.cmd_vfs_load(args);   return
         self.println(f"{cmd}: command not found")
 
     # ---- Команды ----
@@ -602,6 +879,69 @@ class ShellEmulatorGUI:
             return False
         return True
 
+    def _host_path(self, raw: str) -> str:
+        # Пути к CSV/каталогам на реальной ФС: в режиме ОС — относительно cwd шелла,
+        # в режиме VFS (cwd виртуальный) — относительно каталога запуска эмулятора
+        if self.vfs_mode:
+            return os.path.abspath(os.path.expanduser(raw))
+        return self.fs.abspath(self.cwd, raw)
+
+    def _print_warnings(self, cmd: str, warnings: List[str]):
+        for w in warnings:
+            self.println(f"{cmd}: warning: {w}")
+
+    def cmd_vfs_export(self, args: List[str]):
+        # vfs-export [PATH] OUT: PATH — в текущей ФС, OUT — файл на реальной ФС
+        if not args or len(args) > 2:
+            self.println("vfs-export: usage: vfs-export [PATH] OUT"); return
+        src = args[0] if len(args) == 2 else "."
+        out_path = self._host_path(args[-1])
+        start = self.fs.abspath(self.cwd, src)
+        if not self.fs.is_dir(start):
+            self.println(f"vfs-export: {src}: Not a directory"); return
+        skip = [] if self.vfs_mode else [out_path, out_path + ".tmp"]
+        warnings: List[str] = []
+        try:
+            count = write_csv_atomic(out_path, lambda f: export_csv(self.fs, start, f, skip, warnings))
+        except (OSError, ValueError) as e:
+            self._print_warnings("vfs-export", warnings)
+            self.println(f"vfs-export: {e}"); return
+        self._print_warnings("vfs-export", warnings)
+        self.println(f"[info] exported {count} entries to {out_path}")
+
+    def cmd_vfs_diff(self, args: List[str]):
+        # vfs-diff OLD NEW OUT: OLD/NEW — CSV-образы или каталоги реальной ФС
+        if len(args) != 3:
+            self.println("vfs-diff: usage: vfs-diff OLD NEW OUT"); return
+        old_path, new_path, out_path = (self._host_path(a) for a in args)
+        warnings: List[str] = []
+        try:
+            stats = diff_images(old_path, new_path, out_path, warnings)
+        except (OSError, ValueError, csv.Error) as e:
+            self._print_warnings("vfs-diff", warnings)
+            self.println(f"vfs-diff: {e}"); return
+        self._print_warnings("vfs-diff", warnings)
+        summary = ", ".join(f"{k}={v}" for k, v in stats.items())
+        self.println(f"[info] delta written to {out_path}: {summary}")
+
+    def cmd_vfs_load(self, args: List[str]):
+        # vfs-load CSV: наложить дельту (или полный образ) поверх загруженной VFS
+        if len(args) != 1:
+            self.println("vfs-load: usage: vfs-load CSV"); return
+        if not self.vfs_mode:
+            self.println("vfs-load: only available in VFS mode (--vfs)"); return
+        path = self._host_path(args[0])
+        try:
+            self.fs.load_from_csv(path)
+        except (OSError, ValueError, csv.Error) as e:
+            self.println(f"vfs-load: {e}"); return
+        finally:
+            # cwd мог быть удалён дельтой
+            if not self.fs.is_dir(self.cwd):
+                self.cwd = '/'
+                self._refresh_prompt()
+        self.println(f"[info] VFS updated from CSV: {path}")
+
     def cmd_exit(self):
         answer = messagebox.askyesno("Выход", "Завершить работу эмулятора?")
         if answer:
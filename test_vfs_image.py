@@ -0,0 +1,181 @@
+import io
+import os
+
+import pytest
+
+from main import MemoryVfs, OsFs, diff_csv, diff_images, export_csv, open_image
+
+EDGE_NAMES = ['plain.txt', 'q"uote', 'com,ma', 'new\nline', '~$lock.docx', '~', 'name ', ' lead']
+
+
+def make_tree(root, big_size=200 * 1024):
+    os.makedirs(os.path.join(root, 'sub', 'deep'))
+    for name in EDGE_NAMES:
+        with open(os.path.join(root, 'sub', name), 'wb') as f:
+            f.write(name.encode('utf-8'))
+    with open(os.path.join(root, 'big.bin'), 'wb') as f:
+        f.write(os.urandom(big_size))
+    with open(os.path.join(root, 'sub', 'deep', 'empty'), 'wb'):
+        pass
+
+
+def export_to(fs, start, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        return export_csv(fs, start, f)
+
+
+def export_text(fs, start='/'):
+    buf = io.StringIO()
+    export_csv(fs, start, buf)
+    return buf.getvalue()
+
+
+def load(path):
+    vfs = MemoryVfs()
+    vfs.load_from_csv(path)
+    return vfs
+
+
+def test_export_load_reexport_roundtrip(tmp_path):
+    tree = tmp_path / 'tree'
+    make_tree(str(tree))
+    first = tmp_path / 'first.csv'
+    count = export_to(OsFs(), str(tree), str(first))
+    # 2 каталога + big.bin + empty + файлы с «неудобными» именами
+    assert count == 4 + len(EDGE_NAMES)
+
+    second = tmp_path / 'second.csv'
+    assert export_to(load(str(first)), '/', str(second)) == count
+    assert first.read_text(encoding='utf-8') == second.read_text(encoding='utf-8')
+
+
+def test_big_files_and_edge_names_survive(tmp_path):
+    tree = tmp_path / 'tree'
+    make_tree(str(tree))
+    image = tmp_path / 'image.csv'
+    export_to(OsFs(), str(tree), str(image))
+    vfs = load(str(image))
+
+    assert vfs.read_file('/big.bin') == (tree / 'big.bin').read_bytes()
+    assert len(vfs.read_file('/big.bin')) > 128 * 1024
+    assert vfs.read_file('/sub/deep/empty') == b''
+    assert vfs.list_dir('/sub') == sorted(['deep'] + EDGE_NAMES)
+    for name in EDGE_NAMES:
+        assert vfs.read_file('/sub/' + name) == name.encode('utf-8')
+
+
+def test_diff_then_load_matches_full_export(tmp_path):
+    tree = tmp_path / 'tree'
+    make_tree(str(tree))
+    old_csv = tmp_path / 'old.csv'
+    export_to(OsFs(), str(tree), str(old_csv))
+
+    # файл -> каталог, каталог -> файл, удаление, новое, только mtime, только mode
+    os.remove(tree / 'sub' / 'plain.txt')
+    os.makedirs(tree / 'sub' / 'plain.txt')
+    for name in os.listdir(tree / 'sub' / 'deep'):
+        os.remove(tree / 'sub' / 'deep' / name)
+    os.rmdir(tree / 'sub' / 'deep')
+    (tree / 'sub' / 'deep').write_bytes(b'now a file')
+    os.remove(tree / 'sub' / 'com,ma')
+    (tree / 'added').write_bytes(b'added')
+    os.utime(tree / 'sub' / 'q"uote', (1, 1))
+    os.chmod(tree / 'big.bin', 0o600)
+
+    delta_csv = tmp_path / 'delta.csv'
+    old_fs, old_start = open_image(str(old_csv))
+    with open(delta_csv, 'w', encoding='utf-8', newline='') as f:
+        stats = diff_csv(old_fs, old_start, OsFs(), str(tree), f)
+    assert stats['meta'] == 2  # q"uote (контент тот же) и big.bin
+    assert stats['del'] == 3
+
+    vfs = load(str(old_csv))
+    vfs.load_from_csv(str(delta_csv))
+    new_csv = tmp_path / 'new.csv'
+    export_to(OsFs(), str(tree), str(new_csv))
+    assert export_text(vfs) == export_text(load(str(new_csv)))
+
+
+def test_diff_resets_mode_to_none(tmp_path):
+    old, new = MemoryVfs(), MemoryVfs()
+    for vfs, mode in ((old, '0o100644'), (new, '')):
+        src = tmp_path / 'src.csv'
+        src.write_text('path,type,data_b64,mode,mtime\n/f,file,eA==,%s,5\n' % mode, encoding='utf-8')
+        vfs.load_from_csv(str(src))
+
+    delta = tmp_path / 'delta.csv'
+    with open(delta, 'w', encoding='utf-8', newline='') as f:
+        assert diff_csv(old, '/', new, '/', f)['meta'] == 1
+    old.load_from_csv(str(delta))
+    assert old.lstat('/f')[1] is None
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs bytes filenames')
+def test_non_utf8_name_is_skipped_with_warning(tmp_path):
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'ok').write_bytes(b'ok')
+    with open(os.path.join(os.fsencode(tree), b'bad\xff'), 'wb') as f:
+        f.write(b'x')
+
+    warnings = []
+    buf = io.StringIO()
+    assert export_csv(OsFs(), str(tree), buf, warnings=warnings) == 1
+    assert len(warnings) == 1 and 'non-UTF-8' in warnings[0]
+
+
+def test_unreadable_dir_is_reported_and_not_deleted(tmp_path, monkeypatch):
+    tree = tmp_path / 'tree'
+    make_tree(str(tree))
+    old_csv = tmp_path / 'old.csv'
+    export_to(OsFs(), str(tree), str(old_csv))
+
+    blocked = str(tree / 'sub')
+    real_scandir = os.scandir
+
+    def scandir(path='.'):
+        if os.fspath(path) == blocked:
+            raise PermissionError(13, 'Permission denied', blocked)
+        return real_scandir(path)
+    monkeypatch.setattr(os, 'scandir', scandir)
+
+    warnings = []
+    delta = io.StringIO()
+    old_fs, old_start = open_image(str(old_csv))
+    stats = diff_csv(old_fs, old_start, OsFs(), str(tree), delta, warnings=warnings)
+    assert stats['del'] == 0
+    assert ',del,' not in delta.getvalue()
+    assert len(warnings) == 1 and blocked in warnings[0]
+
+    warnings = []
+    export_csv(OsFs(), str(tree), io.StringIO(), warnings=warnings)
+    assert len(warnings) == 1
+
+
+def test_diff_skips_snapshot_inside_tree(tmp_path):
+    tree = tmp_path / 'tree'
+    make_tree(str(tree))
+    snap = tree / 'snap.csv'
+    with open(snap, 'w', encoding='utf-8', newline='') as f:
+        export_csv(OsFs(), str(tree), f, skip=[str(snap)])
+    (tree / 'added').write_bytes(b'added')
+
+    delta = tree / 'delta.csv'
+    stats = diff_images(str(snap), str(tree), str(delta))
+    assert stats == {'dir': 0, 'file': 1, 'meta': 0, 'del': 0}  # только added
+    text = delta.read_text(encoding='utf-8')
+    assert '/snap.csv' not in text and '/delta.csv' not in text
+
+
+def test_bad_delta_leaves_vfs_unchanged(tmp_path):
+    image = tmp_path / 'image.csv'
+    image.write_text('path,type,data_b64,mode,mtime\n/a,file,YQ==,,1\n/b,file,Yg==,,1\n', encoding='utf-8')
+    vfs = load(str(image))
+    before = export_text(vfs)
+
+    for bad_row in ('/b,file,eA=,,2', '/b,file,eA==,,oops'):
+        delta = tmp_path / 'delta.csv'
+        delta.write_text('path,type,data_b64,mode,mtime\n/a,del,,,\n%s\n' % bad_row, encoding='utf-8')
+        with pytest.raises(ValueError):
+            vfs.load_from_csv(str(delta))
+        assert export_text(vfs) == before